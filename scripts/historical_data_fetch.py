@@ -1,17 +1,40 @@
 #!/usr/bin/env python3
-# Backfill ENTSO-E Actual Total Load for Sweden total + zones → one Parquet (UTC)
-# Output schema: ['date','zone','load_mw']
+# Backfill ENTSO-E Actual Total Load for Sweden total + zones → the site's partitioned history dataset (UTC)
+# Output schema: ['date','zone','load_mw'], written through src/data_fetch.update_history_parquet_multi
 
 import os
+import sys
+import asyncio
 import argparse
+import xml.etree.ElementTree as ET
 from pathlib import Path
+import aiohttp
+import numpy as np
 import pandas as pd
-from entsoe import EntsoePandasClient
+import pyarrow as pa
+from entsoe.mappings import lookup_area
+from entsoe.parsers import parse_loads
+
+# Share the history layout/merge code with the site build (src/ modules import each other flat)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+from config import PARQUET_FILE, BACKFILL_DAYS
+from data_fetch import update_history_parquet_multi, read_history
 
 # Request in your familiar TZ; store in UTC
 QUERY_TZ = "Europe/Stockholm"
 STORE_TZ = "UTC"
 
+# Fetched rows are buffered and merged into the dataset in batches of about this many rows
+FLUSH_ROWS = 500_000
+
+# ENTSO-E transparency REST endpoint (same one entsoe-py talks to)
+ENTSOE_URL = "https://web-api.tp.entsoe.eu/api"
+
+# Concurrency / retry settings for the async backfill
+MAX_CONCURRENCY = 20                        # in-flight requests at once
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # rate-limited or transient server errors
+
 # Default mapping: aliases that entsoe-py usually accepts.
 # If your entsoe-py needs EIC codes instead, run with --use-eic
 ZONE_CODES_ALIAS = {
@@ -35,60 +58,207 @@ def month_ranges(start: pd.Timestamp, end: pd.Timestamp):
     
     """Yield [a, b) month windows from start (inclusive) to end (exclusive)."""
     
-    for a in pd.date_range(start, end, freq="MS", tz=start.tz):
-        b = min(a + pd.offsets.MonthBegin(1), end)
-        
+    # All window boundaries in one vectorized call: start, the month starts in between, end.
+    # start may fall mid-month (incremental runs): first window is the partial month from start
+    firsts = pd.date_range(start.normalize(), end, freq="MS", tz=start.tz)
+    bounds = firsts[(firsts > start) & (firsts < end)].insert(0, start).append(pd.DatetimeIndex([end]))
+    
+    for a, b in zip(bounds[:-1], bounds[1:]):
         if a < b:
             yield a, b
 
+def _in_window(df: pd.DataFrame, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    
+    """Rows of a time-indexed response within [start, end), so adjacent windows never overlap."""
+    
+    return df[(df.index >= start) & (df.index < end)]
+
+def _pick_value_column(df: pd.DataFrame, value_name: str) -> pd.Series:
+    
+    """Slow path for multi-column responses: pick (or sum) the value column."""
+    
+    if value_name in df.columns:
+        return df[value_name]
+    
+    num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    if len(num_cols) == 1:
+        return df[num_cols[0]]
+    if len(num_cols) > 1:
+        return df[num_cols].sum(axis=1)
+    
+    value_cols = [c for c in df.columns if c != (df.index.name or "index")]
+    if not value_cols:
+        raise ValueError("No value column in response.")
+    
+    return df[value_cols[0]]
+
 def _to_tidy(df_or_s, value_name: str) -> pd.DataFrame:
     
-    """Normalize Series/DataFrame to ['date','<value_name>'] with UTC datetimes."""
+    """Normalize Series/DataFrame to ['date','<value_name>'] with UTC datetimes (float32 values)."""
     
     if isinstance(df_or_s, pd.Series):
-        df = df_or_s.to_frame(name=value_name)
+        s = df_or_s
+    elif df_or_s.shape[1] == 1:
+        s = df_or_s.iloc[:, 0]
     else:
-        df = df_or_s.copy()
-
-    # ensure tz-aware index, convert to UTC
-    if df.index.tz is None:
-        df.index = df.index.tz_localize("UTC")
-    df.index = df.index.tz_convert(STORE_TZ)
-
-    # pick / coerce numeric value column if needed
-    if value_name not in df.columns:
-        num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
-        if len(num_cols) == 1:
-            df.rename(columns={num_cols[0]: value_name}, inplace=True)
-        elif len(num_cols) > 1:
-            df[value_name] = df[num_cols].sum(axis=1)
-        else:
-            value_cols = [c for c in df.columns if c != (df.index.name or "index")]
-            if not value_cols:
-                raise ValueError("No value column in response.")
-            df.rename(columns={value_cols[0]: value_name}, inplace=True)
-
-    tidy = (
-        df.rename_axis("date")
-          .reset_index()[["date", value_name]]
-          .dropna(subset=["date", value_name])
-          .copy()
-    )
+        s = _pick_value_column(df_or_s, value_name)
+
+    # ensure tz-aware index, convert to UTC (index only, no frame copies)
+    idx = s.index
+    if idx.tz is None:
+        idx = idx.tz_localize("UTC")
+    idx = idx.tz_convert(STORE_TZ)
+
+    vals = pd.to_numeric(s.to_numpy(), errors="coerce").astype("float64")
+    mask = ~(idx.isna() | np.isnan(vals))   # one pass drops rows missing either date or value
+
+    tidy = pd.DataFrame({"date": idx[mask], value_name: vals[mask].astype("float32")})
+    
+    if not tidy["date"].is_monotonic_increasing:
+        tidy = tidy.sort_values("date", ignore_index=True)
     
-    tidy["date"] = pd.to_datetime(tidy["date"], utc=True)
-    tidy[value_name] = pd.to_numeric(tidy[value_name], errors="coerce")
+    return tidy
+
+def _query_params(api_key: str, eics: list[str], start: pd.Timestamp, end: pd.Timestamp) -> list[tuple[str, str]]:
+    
+    """A65 (System total load) / A16 (Realised) query; one outBiddingZone_Domain per EIC."""
     
-    return tidy.dropna(subset=[value_name]).sort_values("date").reset_index(drop=True)
+    return [
+        ("securityToken", api_key),
+        ("documentType", "A65"),
+        ("processType", "A16"),
+        *[("outBiddingZone_Domain", eic) for eic in eics],
+        ("periodStart", start.tz_convert("UTC").strftime("%Y%m%d%H%M")),
+        ("periodEnd", end.tz_convert("UTC").strftime("%Y%m%d%H%M")),
+    ]
 
-def fetch_load_chunk(client: EntsoePandasClient, area_code: str,
-                     start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+async def _request(session: aiohttp.ClientSession, sem: asyncio.Semaphore,
+                   params: list[tuple[str, str]]) -> str | None:
     
-    """One area for one month window → ['date','load_mw'] UTC."""
+    """GET the REST endpoint with retries → XML text, or None when ENTSO-E has no data."""
+    
+    for attempt in range(MAX_RETRIES):
+        last = attempt == MAX_RETRIES - 1
+        try:
+            async with sem, session.get(ENTSOE_URL, params=params) as resp:
+                text = await resp.text()
+                
+                # 429/5xx: retry (below) unless this was the last attempt
+                if resp.status not in RETRY_STATUSES or last:
+                    # ENTSO-E answers "no data" with an acknowledgement document, not a load series
+                    if "No matching data found" in text:
+                        return None
+                    
+                    resp.raise_for_status()
+                    return text
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            # Connection resets, DNS failures and timeouts are retried like 5xx
+            if last:
+                raise
+        
+        # Back off exponentially (1s, 2s, 4s, ...) with the response and the semaphore slot released
+        await asyncio.sleep(2 ** attempt)
+
+def _split_by_zone(xml_text: str) -> dict[str, str]:
+    
+    """Split a multi-zone load document into one document per outBiddingZone_Domain EIC."""
+    
+    root = ET.fromstring(xml_text)
+    ns = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+    if ns:
+        ET.register_namespace("", ns.strip("{}"))  # keep unprefixed tags for entsoe-py's parser
+
+    series = root.findall(f"{ns}TimeSeries")
+    by_zone = {}
+    for ts in series:
+        by_zone.setdefault(ts.findtext(f"{ns}outBiddingZone_Domain.mRID"), []).append(ts)
+        root.remove(ts)
+
+    docs = {}
+    for eic, zone_series in by_zone.items():
+        root.extend(zone_series)
+        docs[eic] = ET.tostring(root, encoding="unicode")
+        for ts in zone_series:
+            root.remove(ts)
+
+    return docs
+
+async def fetch_one(session: aiohttp.ClientSession, sem: asyncio.Semaphore, api_key: str,
+                    area_code: str, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
     
-    res = client.query_load(area_code, start=start, end=end)
+    """One area for one month window → ['date','load_mw'] UTC, fetched straight from the REST API."""
+    
+    text = await _request(session, sem, _query_params(api_key, [lookup_area(area_code).code], start, end))
+    if text is None:
+        return pd.DataFrame(columns=["date", "load_mw"])
+
+    res = _in_window(parse_loads(text, process_type="A16"), start, end)
     
     return _to_tidy(res, value_name="load_mw")
 
+async def fetch_zones(session: aiohttp.ClientSession, sem: asyncio.Semaphore, api_key: str,
+                      zones: list[tuple[str, str]], start: pd.Timestamp, end: pd.Timestamp) -> dict[str, pd.DataFrame]:
+    
+    """
+    All zones for one month window in a single request → {label: ['date','load_mw'] UTC}.
+    
+    Falls back to one request per zone if the endpoint rejects the batched form (HTTP 400)
+    or leaves zones out of its answer.
+    """
+    
+    eics = {label: lookup_area(area).code for label, area in zones}
+    out = {}
+
+    if len(zones) > 1:
+        try:
+            text = await _request(session, sem, _query_params(api_key, list(eics.values()), start, end))
+        except aiohttp.ClientResponseError as e:
+            if e.status != 400:
+                raise
+            text = None
+        
+        docs = _split_by_zone(text) if text is not None else {}
+        for label in eics:
+            if eics[label] in docs:
+                res = _in_window(parse_loads(docs[eics[label]], process_type="A16"), start, end)
+                out[label] = _to_tidy(res, value_name="load_mw")
+
+    missing = [(label, area) for label, area in zones if label not in out]
+    dfs = await asyncio.gather(*[fetch_one(session, sem, api_key, area, start, end) for _, area in missing])
+    out.update(zip([label for label, _ in missing], dfs))
+    
+    return out
+
+async def fetch_all(api_key: str, zones: list[tuple[str, str]],
+                    starts: dict[str, pd.Timestamp], end: pd.Timestamp, on_chunk) -> None:
+    
+    """
+    Fetch every month window concurrently, handing each non-empty ['date','load_mw','zone']
+    frame to on_chunk as soon as its window completes.
+    
+    starts: per zone label, where that zone's fetch begins. Zones sharing a window are batched.
+    """
+    
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    windows = {}
+    for label, area in zones:
+        for a, b in month_ranges(starts[label], end):
+            windows.setdefault((a, b), []).append((label, area))
+
+    async def fetch_window(session, window_zones, a, b):
+        print(f"Fetching {','.join(label for label, _ in window_zones)} {a.strftime('%Y-%m')} ...", flush=True)
+        per_zone = await fetch_zones(session, sem, api_key, window_zones, a, b)
+        return [df.assign(zone=label) for label, df in per_zone.items()]
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        for done in asyncio.as_completed([
+            fetch_window(session, window_zones, a, b) for (a, b), window_zones in windows.items()
+        ]):
+            for df in await done:
+                if not df.empty:
+                    on_chunk(df)
+
 def parse_zones_arg(zones_csv: str, mapping: dict[str, str]) -> list[tuple[str, str]]:
     
     """Parse 'SE_total,SE1,SE2,SE3,SE4' into [(label, area_code), ...]."""
@@ -99,16 +269,20 @@ def parse_zones_arg(zones_csv: str, mapping: dict[str, str]) -> list[tuple[str,
     if unknown:
         raise SystemExit(f"Unknown zone labels: {unknown}. Allowed: {list(mapping.keys())}")
     
-    return [(z, mapping[z]) for z in labels]
+    return [(z, mapping[z]) for z in dict.fromkeys(labels)]
 
 def main():
     
     ap = argparse.ArgumentParser(
-        description="Backfill ENTSO-E Actual Total Load for Sweden zones into one Parquet (UTC)."
+        description="Backfill ENTSO-E Actual Total Load for Sweden zones into the partitioned history dataset (UTC)."
     )
     ap.add_argument("--start", required=True, help="YYYY-MM-DD (inclusive)")
     ap.add_argument("--end", required=True, help="YYYY-MM-DD (exclusive)")
-    ap.add_argument("--out", required=True, help="Parquet output file, e.g. data/load_se_zones.parquet")
+    ap.add_argument(
+        "--out",
+        default=str(PARQUET_FILE),
+        help=f"History dataset directory (zone=/year= partitions), default: {PARQUET_FILE}",
+    )
     ap.add_argument(
         "--zones",
         default="SE_total,SE1,SE2,SE3,SE4",
@@ -133,38 +307,56 @@ def main():
     mapping = ZONE_CODES_EIC if args.use_eic else ZONE_CODES_ALIAS
     zones = parse_zones_arg(args.zones, mapping)
 
-    client = EntsoePandasClient(api_key=api_key)
+    out_path = Path(args.out)
 
-    frames = []
-    
-    for a, b in month_ranges(start, end):
-        ym = a.strftime("%Y-%m")
+    # Only fetch what is missing: resume each zone BACKFILL_DAYS before its last stored timestamp
+    last_ts = {}
+    if out_path.exists():
+        stored = read_history(out_path).select(["date", "zone"]).to_pandas()
+        last_ts = stored.groupby("zone", observed=True)["date"].max().to_dict()
+        del stored
+
+    starts = {
+        label: max(start, (last_ts[label] - pd.Timedelta(days=BACKFILL_DAYS)).tz_convert(QUERY_TZ))
+        if label in last_ts else start
+        for label, _ in zones
+    }
+
+    # Merge fetched chunks into the dataset in batches (re-fetched timestamps replace stored ones)
+    pending = []
+    stats = {"rows": 0, "pending": 0, "zones": set(), "min": None, "max": None}
+
+    def flush() -> None:
+        if pending:
+            update_history_parquet_multi(pa.concat_tables(pending, promote_options="permissive"), out_path)
+            pending.clear()
+            stats["pending"] = 0
+
+    def on_chunk(df: pd.DataFrame) -> None:
+        pending.append(pa.Table.from_pandas(df[["date", "zone", "load_mw"]], preserve_index=False))
         
-        for label, area in zones:
-            print(f"Fetching {label} ({area}) {ym} ...", flush=True)
-            df = fetch_load_chunk(client, area, a, b)
-            
-            if not df.empty:
-                df["zone"] = label
-                frames.append(df)
-
-    if not frames:
-        raise SystemExit("No data fetched. Check your API key, zones, and date range.")
+        stats["rows"] += len(df)
+        stats["pending"] += len(df)
+        stats["zones"].update(df["zone"].astype(str).unique())
+        lo, hi = df["date"].min(), df["date"].max()
+        stats["min"] = lo if stats["min"] is None else min(stats["min"], lo)
+        stats["max"] = hi if stats["max"] is None else max(stats["max"], hi)
+        
+        if stats["pending"] >= FLUSH_ROWS:
+            flush()
 
-    full = (
-        pd.concat(frames, ignore_index=True)
-          .drop_duplicates(subset=["date", "zone"], keep="last")
-          .sort_values(["zone", "date"])
-          .reset_index(drop=True)
-    )
+    try:
+        asyncio.run(fetch_all(api_key, zones, starts, end, on_chunk))
+    finally:
+        # Keep whatever was fetched before a failure; the next run resumes from it
+        flush()
 
-    out_path = Path(args.out)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    full.to_parquet(out_path, index=False)
+    if stats["rows"] == 0:
+        raise SystemExit("No data fetched. Check your API key, zones, and date range.")
 
     print(
-        f"Wrote {len(full):,} rows across {full['zone'].nunique()} zones "
-        f"to {out_path.resolve()} ({full['date'].min()} → {full['date'].max()})"
+        f"Merged {stats['rows']:,} fetched rows across {len(stats['zones'])} zones "
+        f"into {out_path.resolve()} ({stats['min']} → {stats['max']})"
     )
 
 if __name__ == "__main__":
@@ -176,5 +368,6 @@ if __name__ == "__main__":
 # $env:ENTSOE_API_KEY="your_key_here"
 
 # Then run the script, e.g. to backfill Swedish load from 2015-01-01 to 2025-09-11:
-# python scripts/historical_data_fetch.py --start 2015-01-01 --end 2025-09-11 --out data/load_se_zones.parquet
+# python scripts/historical_data_fetch.py --start 2015-01-01 --end 2025-09-11
+# (writes into data/load_se_zones/ by default; pass --out to target another dataset directory)
 
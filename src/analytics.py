@@ -9,18 +9,15 @@ def compute_yearly_peak_loads(df: pd.DataFrame) -> pd.DataFrame:
 
     Returns: DataFrame with columns ['Year', 'Date', 'Load (MW)']. (TZ)
     """
-    max_loads = []
+    # One vectorized pass: row label of the max load per year
+    years = df["Date"].dt.year.rename("Year")
+    idx = df.groupby(years, sort=True)["Load (MW)"].idxmax()
 
-    for year in df["Date"].dt.year.unique():
-        yearly_data = df[df["Date"].dt.year == year]
-        max_load = yearly_data.sort_values(by="Load (MW)", ascending=False).iloc[0]
-        max_loads.append({
-            "Year": year,
-            "Date": max_load["Date"],
-            "Load (MW)": max_load["Load (MW)"],
-        })
-
-    yearly_peaks = pd.DataFrame(max_loads).sort_values("Year").reset_index(drop=True)
+    yearly_peaks = (
+        df.loc[idx, ["Date", "Load (MW)"]]
+          .assign(Year=years.loc[idx].values)
+          .reset_index(drop=True)[["Year", "Date", "Load (MW)"]]
+    )
     yearly_peaks["Date"] = yearly_peaks["Date"].dt.strftime("%Y-%m-%d %H:%M")
 
     return yearly_peaks
@@ -7,6 +7,7 @@ DAYS_BACK = 14
 BACKFILL_DAYS = 3            # re-fetch recent days to capture revisions & backfill if no data is available for a few days/hours
 INITIAL_HISTORY_DAYS = 60    # used only on first run (no parquet yet)
 INITIAL_DAYS = 14            # initial viewport in plot
+PLOT_MAX_POINTS = 4000       # longer series are LTTB-downsampled to this many points before plotting
 
 # Bidding zones for entsoe-py to recognize
 ZONE_CODES = {
@@ -26,7 +27,16 @@ SITE_TAGLINE = "Welcome! This is my ongoing project to visualize and analyze Swe
 # Output
 OUTPUT_DIR = Path("docs")
 OUTPUT_FILE = OUTPUT_DIR / "index.html"
+PLOTLY_JS_FILE = OUTPUT_DIR / "assets" / "plotly.min.js"   # served from our own origin instead of the CDN
+PRECOMPRESS_PAGE = False     # also write index.html.gz (+ .br if the optional `brotli` package is installed);
+                             # only useful on hosts that serve them (not GitHub Pages)
 
 # Storage
 DATA_DIR = Path("data")
-PARQUET_FILE = DATA_DIR / f"load_{COUNTRY_CODE.lower()}_zones.parquet"
\ No newline at end of file
+PARQUET_FILE = DATA_DIR / f"load_{COUNTRY_CODE.lower()}_zones"                  # dataset dir, hive-partitioned by zone/year
+LEGACY_PARQUET_FILE = DATA_DIR / f"load_{COUNTRY_CODE.lower()}_zones.parquet"   # old single-file history, migrated on first run
+
+# Rendered-figure cache (kept between CI runs by actions/cache, not committed)
+CACHE_DIR = Path(".cache")
+FIG_CACHE_FILE = CACHE_DIR / "zones_fig.html"
+FIG_CACHE_KEY_FILE = CACHE_DIR / "zones_fig.key"
\ No newline at end of file
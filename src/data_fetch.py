@@ -1,6 +1,15 @@
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import requests
 from entsoe import EntsoePandasClient
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from config import (
     TZ, COUNTRY_CODE, DAYS_BACK, BACKFILL_DAYS, INITIAL_HISTORY_DAYS,
@@ -8,6 +17,31 @@ from config import (
     DATA_DIR, ZONE_CODES, TARGET_ZONES
 )
 
+# History layout on disk: <PARQUET_FILE>/zone=SE1/year=2025/part-0.parquet
+HISTORY_PARTITIONING = ds.partitioning(
+    pa.schema([("zone", pa.string()), ("year", pa.int32())]), flavor="hive"
+)
+
+# Zones are dictionary-encoded against one shared, ordered dictionary (TARGET_ZONES), so every
+# table agrees on the int8 codes and pandas gets an ordered Categorical on conversion
+ZONE_DICTIONARY = pa.array(TARGET_ZONES, pa.string())
+ZONE_TYPE = pa.dictionary(pa.int8(), pa.string(), ordered=True)
+
+# In-memory storage schema (what to_storage_df produces and update_history_parquet_multi consumes)
+STORAGE_SCHEMA = pa.schema([
+    ("date", pa.timestamp("ns", tz="UTC")),
+    ("zone", ZONE_TYPE),
+    ("load_mw", pa.float32()),
+])
+
+# float32 is ample for MW values and halves the bytes per row; older float64 files are cast on read
+HISTORY_SCHEMA = pa.schema([
+    ("date", pa.timestamp("ns", tz="UTC")),
+    ("load_mw", pa.float32()),
+    ("zone", pa.string()),
+    ("year", pa.int32()),
+])
+
 #########################################################################################
 
 def get_time_range(days_back: int) -> tuple[pd.Timestamp, pd.Timestamp]:
@@ -20,11 +54,34 @@ def get_time_range(days_back: int) -> tuple[pd.Timestamp, pd.Timestamp]:
     
     """
     
-    now = pd.Timestamp.now(tz=TZ).floor("h")
-    start = now - pd.Timedelta(days=days_back)
-    end = now
+    # Work in UTC internally; TZ is only applied for display (to_display_table)
+    # (plain datetime arithmetic, wrapped in pd.Timestamp only for the return value)
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    
+    return pd.Timestamp(now - timedelta(days=days_back)), pd.Timestamp(now)
+
+#########################################################################################
+
+def make_client(api_key: str) -> EntsoePandasClient:
+    
+    """
+    Create an EntsoePandasClient backed by one persistent keep-alive session.
+    
+    api_key: ENTSO-E API key.
+    
+    Returns: EntsoePandasClient reusing pooled TCP/TLS connections, with retries on 429/5xx.
+    
+    """
+    
+    session = requests.Session()
+    session.headers["Connection"] = "keep-alive"
+    session.mount("https://", HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=8,
+        max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+    ))
     
-    return start, end
+    return EntsoePandasClient(api_key=api_key, session=session)
 
 #########################################################################################
 
@@ -42,7 +99,7 @@ def fetch_load_df(client: EntsoePandasClient, country_code: str,
     start: start timestamp.
     end: end timestamp.
     
-    Returns: DataFrame with columns: Date (tz-aware) and Load (MW).
+    Returns: DataFrame with columns: Date (UTC) and Load (MW).
     
     NOTE: the load data is typically available with a delay of 1 hour.
     (The data is published and retrivable 1 hour after the time period has passed) 
@@ -57,99 +114,250 @@ def fetch_load_df(client: EntsoePandasClient, country_code: str,
     else:
         df = data.to_frame()
 
-    # Ensure tz-aware, convert to display TZ, and make Date a column
+    # Ensure tz-aware, keep UTC (display TZ is applied only before plotting), and make Date a column
     if df.index.tz is None:
         df.index = df.index.tz_localize("UTC")
-        
-    df.index = df.index.tz_convert(TZ)
+    else:
+        df.index = df.index.tz_convert("UTC")
     df = df.rename_axis("Date").reset_index()
 
-    # Rename the (single) value column to Load (MW)
-    value_cols = [c for c in df.columns if c != "Date"]
-    
-    if not value_cols:
+    # Keep Date + the first value column, named positionally
+    if df.shape[1] < 2:
         raise ValueError("No value column returned from ENTSO-E.")
-    df.rename(columns={value_cols[0]: "Load (MW)"}, inplace=True)
+    if df.shape[1] > 2:
+        df = df.iloc[:, :2].copy()
+    df.columns = ["Date", "Load (MW)"]
+
+    # Date is already tz-aware datetime64 from the index; only the values need coercing (float32 is plenty for MW)
+    df["Load (MW)"] = pd.to_numeric(df["Load (MW)"], errors="coerce").astype("float32")
 
-    # Enforce dtypes and return only the two columns
-    df["Date"] = pd.to_datetime(df["Date"])
-    df["Load (MW)"] = pd.to_numeric(df["Load (MW)"], errors="coerce")
+    # ENTSO-E returns ordered series, so only sort when it is actually needed
+    if not df["Date"].is_monotonic_increasing:
+        df = df.sort_values("Date")
 
-    return df.sort_values("Date")[["Date", "Load (MW)"]].reset_index(drop=True)
+    return df.reset_index(drop=True)
 
 #########################################################################################
 
-def to_storage_df(display_df: pd.DataFrame, zone_label: str) -> pd.DataFrame:
+def zone_array(zones: pa.Array | pa.ChunkedArray) -> pa.DictionaryArray:
+    
+    """
+    Encode zone labels against the shared ZONE_DICTIONARY.
+    
+    zones: string or dictionary array of zone labels, e.g. "SE_total", "SE1".
+    
+    Returns: DictionaryArray of type ZONE_TYPE; labels outside TARGET_ZONES become null.
+    
+    """
+    
+    codes = pc.index_in(zones.cast(pa.string()), value_set=ZONE_DICTIONARY)
+    if isinstance(codes, pa.ChunkedArray):
+        codes = codes.combine_chunks()
+    
+    return pa.DictionaryArray.from_arrays(codes.cast(pa.int8()), ZONE_DICTIONARY, ordered=True)
+
+
+def _zone_column(code: int, n: int) -> pa.DictionaryArray:
+    
+    # n rows of the same zone, given by its index in TARGET_ZONES
+    return pa.DictionaryArray.from_arrays(np.full(n, code, dtype=np.int8), ZONE_DICTIONARY, ordered=True)
+
+
+def _zone_codes(zones: pa.ChunkedArray) -> np.ndarray:
+    
+    # int8 codes into TARGET_ZONES (nulls, if any, come out as 0; callers filter them first)
+    return zones.combine_chunks().indices.fill_null(0).to_numpy()
+
+#########################################################################################
+
+def to_storage_df(display_df: pd.DataFrame, zone_label: str) -> pa.Table:
     
     """
     Convert display schema to storage schema for one zone.
         
-    display_df: columns ["Date","Load (MW)"] in display TZ.
+    display_df: columns ["Date","Load (MW)"], tz-aware (UTC from fetch_load_df).
     zone_label: e.g. "SE_total", "SE1", etc.
     
-    Returns columns ["date","zone","load_mw"] in UTC.
+    Returns an Arrow table with columns ["date","zone","load_mw"] in UTC (STORAGE_SCHEMA).
     
-    """
+    NOTE: tables from several zones share the schema, so pa.concat_tables can stitch them without copying.
     
-    out = display_df.copy()
-    out["date"] = out["Date"].dt.tz_convert("UTC")
-    out["load_mw"] = out["Load (MW)"]
-    out["zone"] = zone_label
+    """
     
-    return out[["date", "zone", "load_mw"]]
+    return pa.table({
+        "date": pa.array(display_df["Date"].dt.tz_convert("UTC").dt.as_unit("ns")),
+        "zone": _zone_column(TARGET_ZONES.index(zone_label), len(display_df)),
+        "load_mw": pa.array(display_df["Load (MW)"], pa.float32()),
+    }, schema=STORAGE_SCHEMA)
 
 #########################################################################################
 
-def to_display_df(storage_df: pd.DataFrame, tz: str) -> pd.DataFrame:
+def to_display_table(storage_table: pa.Table, tz: str) -> pa.Table:
     
     """
     Convert storage schema to display schema in tz.
     
-    storage_df: columns ["date","zone","load_mw"] in UTC.
+    storage_table: Arrow table with columns ["date","zone","load_mw"] in UTC.
     tz: target timezone string, "Europe/Stockholm".
     
-    Returns columns ["Date","Load (MW)","zone"] in tz.
+    Returns an Arrow table with columns ["Date","Load (MW)","zone"] in tz, sorted by zone then Date.
+    
+    NOTE: the rename and the tz change are metadata-only; the sort is the only pass over the data.
     
     """
     
-    out = storage_df.copy()
-    out["Date"] = out["date"].dt.tz_convert(tz)
-    out["Load (MW)"] = out["load_mw"]
+    date_type = pa.timestamp(storage_table.schema.field("date").type.unit, tz=tz)
+    
+    out = pa.table({
+        "Date": storage_table["date"].cast(date_type),
+        "Load (MW)": storage_table["load_mw"],
+        "zone": storage_table["zone"],
+    })
     
-    return out[["Date", "Load (MW)", "zone"]].sort_values(["zone", "Date"]).reset_index(drop=True)
+    # Arrow can't sort dictionary columns; a stable lexsort on (zone code, int64 date) gives the same order
+    order = np.lexsort((storage_table["date"].cast(pa.int64()).to_numpy(), _zone_codes(storage_table["zone"])))
+    
+    return out.take(order)
 
 #########################################################################################
 
-def update_history_parquet_multi(new_df: pd.DataFrame, parquet_path: Path) -> pd.DataFrame:
+def update_history_parquet_multi(new_table: pa.Table, parquet_path: Path) -> pa.Table:
     
     """
     
-    Append + dedupe on ['date','zone'] and write back.
+    Append + dedupe on ['date','zone'] and write back only the (zone, year) partitions touched by new_table.
+    
+    new_table: Arrow table with columns ["date","zone","load_mw"] in UTC.
+    parquet_path: directory of the hive-partitioned dataset (zone=.../year=.../*.parquet).
     
-    new_df: columns ["date","zone","load_mw"] in UTC.
-    parquet_path: path to parquet file.
+    returns: deduped rows of the touched partitions, as an Arrow table in STORAGE_SCHEMA.
     
-    returns: full history DataFrame with same columns as new_df.
+    NOTE: partitions are merged and written one at a time, so peak memory is a single (zone, year)
+    slice, and each file is swapped in atomically (a failed run leaves the old partition intact).
     
     """
     
-    if parquet_path.exists():
-        hist = pd.read_parquet(parquet_path)
-        hist["date"] = pd.to_datetime(hist["date"], utc=True)
-        combo = pd.concat([hist, new_df], ignore_index=True)
+    # Normalize to the storage schema (also lets older float64/large_string files through)
+    new = pa.table({
+        "date": new_table["date"].cast(STORAGE_SCHEMA.field("date").type),
+        "zone": zone_array(new_table["zone"]),
+        "load_mw": new_table["load_mw"].cast(pa.float32()),
+    }, schema=STORAGE_SCHEMA)
+    new = new.filter(pc.and_(pc.is_valid(new["date"]), pc.is_valid(new["zone"])))
+
+    # Group rows into contiguous (zone, year) runs; lexsort is stable, so later duplicates stay last
+    zones = _zone_codes(new["zone"])
+    order = np.lexsort((new["date"].cast(pa.int64()).to_numpy(), zones))
+    new, zones = new.take(order), zones[order]
+    years = pc.year(new["date"]).to_numpy()
+    bounds = np.flatnonzero((zones[1:] != zones[:-1]) | (years[1:] != years[:-1])) + 1
+    bounds = np.r_[0, bounds, len(new)] if len(new) else np.array([0])
+
+    parquet_path.mkdir(parents=True, exist_ok=True)
+    touched = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        part_new = new.slice(lo, hi - lo)
+        zone, year = TARGET_ZONES[zones[lo]], int(years[lo])
+        part_dir = parquet_path / f"zone={zone}" / f"year={year}"
+
+        part = _merge_partition(part_dir, part_new.select(["date", "load_mw"]))
+        _write_partition(part_dir, part)
+
+        touched.append(part.append_column("zone", _zone_column(zones[lo], len(part))))
+
+    if not touched:
+        return STORAGE_SCHEMA.empty_table()
+    
+    return pa.concat_tables(touched).select(STORAGE_SCHEMA.names)
+
+#########################################################################################
+
+def _merge_partition(part_dir: Path, new_rows: pa.Table) -> pa.Table:
+    
+    """
+    Merge new rows into one stored partition, deduping on date (new rows win).
+    
+    part_dir: partition directory (zone=.../year=...), may not exist yet.
+    new_rows: columns ["date","load_mw"], sorted by date.
+    
+    Returns: columns ["date","load_mw"], sorted by date with unique dates.
+    
+    """
+    
+    part_schema = pa.schema([HISTORY_SCHEMA.field("date"), HISTORY_SCHEMA.field("load_mw")])
+    
+    if part_dir.exists():
+        old_rows = ds.dataset(part_dir, format="parquet", schema=part_schema).to_table()
+        combo = pa.concat_tables([old_rows, new_rows.cast(part_schema)]).sort_by("date")
     else:
-        combo = new_df.copy()
+        combo = new_rows.cast(part_schema)
+
+    # Dedupe on the sorted dates: keep a row unless the next one has the same timestamp
+    dates = combo["date"].cast(pa.int64()).to_numpy()
+    keep = np.ones(len(dates), dtype=bool)
+    keep[:-1] = dates[1:] != dates[:-1]
+    
+    return combo.filter(keep)
+
+#########################################################################################
 
-    combo = (
-        combo.dropna(subset=["date","zone"])
-             .sort_values(["zone","date"])
-             .drop_duplicates(subset=["date","zone"], keep="last")
-             .reset_index(drop=True)
-    )
+def _write_partition(part_dir: Path, part: pa.Table) -> None:
+    
+    """
+    Write one partition to a temp file and atomically swap it in as part-0.parquet.
+    
+    part_dir: partition directory (zone=.../year=...).
+    part: columns ["date","load_mw"], sorted by date.
+    
+    """
+    
+    part_dir.mkdir(parents=True, exist_ok=True)
+    target = part_dir / "part-0.parquet"
+    # Leading "." so dataset discovery (read_history, _merge_partition) never picks up a half-written file
+    tmp = part_dir / ".part-0.parquet.tmp"
 
-    parquet_path.parent.mkdir(parents=True, exist_ok=True)
-    combo.to_parquet(parquet_path, index=False)
+    try:
+        # Hourly timestamps delta-encode to almost nothing; dictionary-encode only the repetitive MW values
+        with pq.ParquetWriter(tmp, part.schema, compression="zstd", use_dictionary=["load_mw"],
+                              column_encoding={"date": "DELTA_BINARY_PACKED"}) as writer:
+            writer.write_table(part, row_group_size=100_000)
+        tmp.replace(target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    # Drop any other files left in the partition, e.g. from an interrupted older write (all rows are now in part-0)
+    for f in part_dir.iterdir():
+        if f != target and f.is_file():
+            f.unlink()
+
+#########################################################################################
+
+def read_history(parquet_path: Path, since: pd.Timestamp | None = None) -> pa.Table:
+    
+    """
+    
+    Read the history dataset, optionally only from a given time on.
+    
+    parquet_path: directory of the hive-partitioned dataset.
+    since: tz-aware start timestamp, or None for the full history.
+    
+    returns: Arrow table with columns ["date","zone","load_mw"] in UTC.
+    
+    NOTE: with `since`, older year partitions are pruned by directory name and row groups
+    before it are skipped via their footer statistics, so nothing outside the window is decoded.
+    
+    """
+    
+    dataset = ds.dataset(parquet_path, format="parquet", schema=HISTORY_SCHEMA, partitioning=HISTORY_PARTITIONING)
+
+    row_filter = None
+    if since is not None:
+        since = since.tz_convert("UTC")
+        row_filter = (ds.field("year") >= since.year) & (ds.field("date") >= since)
+    
+    table = dataset.to_table(columns=STORAGE_SCHEMA.names, filter=row_filter)
     
-    return combo
+    # The partition key comes back as plain strings; re-encode it against the shared zone dictionary
+    return table.set_column(1, "zone", zone_array(table["zone"]))
 
 #########################################################################################
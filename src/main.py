@@ -1,21 +1,29 @@
 #!/usr/bin/env python3
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import pandas as pd
-from entsoe import EntsoePandasClient
+import pyarrow as pa
+import pyarrow.parquet as pq
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
 
 from config import (
     TZ, COUNTRY_CODE, DAYS_BACK, BACKFILL_DAYS, INITIAL_HISTORY_DAYS,
     SITE_TITLE, SITE_TAGLINE, OUTPUT_DIR, OUTPUT_FILE, PARQUET_FILE, 
-    DATA_DIR, ZONE_CODES, TARGET_ZONES
+    DATA_DIR, ZONE_CODES, TARGET_ZONES, PLOTLY_JS_FILE, LEGACY_PARQUET_FILE,
+    CACHE_DIR, FIG_CACHE_FILE, FIG_CACHE_KEY_FILE, PRECOMPRESS_PAGE, PLOT_MAX_POINTS
 )
 
-from data_fetch import fetch_load_df, get_time_range, to_display_df, to_storage_df, update_history_parquet_multi
-from plotting import make_actual_load_plot, make_all_zones_plot
-from page_builder import build_page
+from data_fetch import make_client, fetch_load_df, get_time_range, to_display_table, to_storage_df, update_history_parquet_multi, read_history
+from plotting import make_actual_load_plot, make_all_zones_plot, figure_cache_key, fig_to_html
+from page_builder import iter_page_parts, write_precompressed
 from analytics import compute_yearly_peak_loads
 
 
+# Serialize figures with the C-based orjson encoder, and resolve the template once
+pio.json.config.default_engine = "orjson"
+pio.templates.default = "plotly_white"
+
 # Load ENTSOE_API_KEY from a local .env file
 try:
     from dotenv import load_dotenv
@@ -30,44 +38,67 @@ def main():
     if not api_key:
         raise SystemExit("Missing ENTSOE_API_KEY")
 
+    # One-off migration: seed the partitioned dataset from the old single-file history
+    if not PARQUET_FILE.exists() and LEGACY_PARQUET_FILE.exists():
+        update_history_parquet_multi(pq.read_table(LEGACY_PARQUET_FILE), PARQUET_FILE)
+        LEGACY_PARQUET_FILE.unlink()
+
     # Decide how much to fetch: first run = long history, otherwise small backfill
     if not PARQUET_FILE.exists():
         start, end = get_time_range(INITIAL_HISTORY_DAYS)
     else:
         start, end = get_time_range(BACKFILL_DAYS)
 
-    client = EntsoePandasClient(api_key=api_key)
+    client = make_client(api_key)
 
     storage_chunks = []
     
-    # Fetch each zone and convert to UTC storage schema
-    for zl in TARGET_ZONES:
+    # Fetch all zones concurrently (I/O-bound; one shared client/session) and convert to UTC storage schema
+    # (transient 429/5xx/connection failures are retried by the session adapter, see make_client)
+    with ThreadPoolExecutor(max_workers=len(TARGET_ZONES)) as ex:
+        futures = {ex.submit(fetch_load_df, client, ZONE_CODES[zl], start, end): zl for zl in TARGET_ZONES}
         
-        code = ZONE_CODES[zl]
-        display_df = fetch_load_df(client, code, start, end)  # -> ["Date","Load (MW)"] (TZ)
-        storage_chunks.append(to_storage_df(display_df, zone_label=zl))  # -> ["date","zone","load_mw"] (UTC)
+        for f in as_completed(futures):
+            display_df = f.result()  # -> ["Date","Load (MW)"] (UTC)
+            storage_chunks.append(to_storage_df(display_df, zone_label=futures[f]))  # -> pa.Table ["date","zone","load_mw"] (UTC)
 
-    recent_store = pd.concat(storage_chunks, ignore_index=True)
+    # Same schema for every zone, so this only stitches the chunks together (no copy)
+    recent_store = pa.concat_tables(storage_chunks)
 
-    # Update parquet history
-    hist_df = update_history_parquet_multi(recent_store, PARQUET_FILE)
+    # Update parquet history (only the zone/year partitions covered by the backfill are rewritten)
+    update_history_parquet_multi(recent_store, PARQUET_FILE)
+    hist_table = read_history(PARQUET_FILE)  # -> pa.Table ["date","zone","load_mw"] (UTC)
 
-    # Convert back all zones to display schema in TZ
-    plot_df = to_display_df(hist_df.copy(), TZ)  # -> ["Date","Load (MW)","zone"] (TZ)
+    # Convert back all zones to display schema in TZ (in Arrow), materializing pandas only once
+    plot_df = to_display_table(hist_table, TZ).to_pandas()  # -> ["Date","Load (MW)","zone"] (TZ)
     
-    # Calculate yearly peaks
-    yearly_peaks = compute_yearly_peak_loads(plot_df)
+    # Calculate yearly peaks of the total load (a zone never exceeds SE_total, so no need to scan all zones)
+    yearly_peaks = compute_yearly_peak_loads(plot_df[plot_df["zone"] == "SE_total"])
 
     print("Yearly peak loads:")
     print(yearly_peaks.to_string(index=False))
 
-    # Build combined multi-line plot
-    fig = make_all_zones_plot(plot_df, "", tz_label=TZ, initial_days=DAYS_BACK)
+    # Vendor plotly.js next to the page and reference it by relative URL
+    PLOTLY_JS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    PLOTLY_JS_FILE.write_text(get_plotlyjs(), encoding="utf-8")
+    plotly_js_src = PLOTLY_JS_FILE.relative_to(OUTPUT_DIR).as_posix()
 
-    # Export plot to HTML snippet & Convert yearly peaks to HTML table
-    fig_html = fig.to_html(include_plotlyjs="cdn", full_html=False,
-                           config={"displaylogo": False, "responsive": True})
+    # Reuse the rendered plot if neither the data nor the plotting code changed since the last run
+    fig_key = figure_cache_key(plot_df, tz=TZ, initial_days=DAYS_BACK, plotly_js=plotly_js_src,
+                               max_points=PLOT_MAX_POINTS)
+    
+    if FIG_CACHE_KEY_FILE.exists() and FIG_CACHE_KEY_FILE.read_text() == fig_key:
+        fig_html = FIG_CACHE_FILE.read_text(encoding="utf-8")
+    else:
+        # Build combined multi-line plot & export to HTML snippet
+        fig = make_all_zones_plot(plot_df, "", tz_label=TZ, initial_days=DAYS_BACK)
+        fig_html = fig_to_html(fig, div_id="zones-all-plot", include_plotlyjs=plotly_js_src)
+        
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        FIG_CACHE_FILE.write_text(fig_html, encoding="utf-8")
+        FIG_CACHE_KEY_FILE.write_text(fig_key)
     
+    # Convert yearly peaks to HTML table
     peaks_table_html = yearly_peaks.to_html(index=False,classes="peak-table",border=0,justify="center",)
 
     sections = [
@@ -81,9 +112,14 @@ def main():
         "fig_html": peaks_table_html},
     ]
 
-    page_html = build_page(sections)
+    # Stream the page to disk piece by piece; the full page is never held in memory as one string
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-    OUTPUT_FILE.write_text(page_html, encoding="utf-8")
+    with open(OUTPUT_FILE, "w", encoding="utf-8", buffering=1 << 20) as f:
+        f.writelines(iter_page_parts(sections))
+
+    # Precompressed siblings only for hosts that serve them (GitHub Pages compresses on the fly)
+    if PRECOMPRESS_PAGE:
+        write_precompressed(OUTPUT_FILE)
     
     print(f" Wrote {OUTPUT_FILE.resolve()} and updated {PARQUET_FILE.resolve()}")
     
@@ -4,43 +4,29 @@ from config import (
     DATA_DIR, ZONE_CODES, TARGET_ZONES
 )
 
+import gzip
 from datetime import datetime
+from pathlib import Path
 from zoneinfo import ZoneInfo
 
 # TODO: Add clickable button for Yearly Peaks table (Or think if I even want to keep it)
 
-def build_page(fig_sections):
-  
-    """
-    fig_sections: list of dicts with keys:
-      - id: str, section id for linking
-      - title: str, section title
-      - blurb: str, short description
-      - fig_html: str, plotly figure HTML div
-      
-    Returns: full HTML page as a str.
-    
-    """
-  
-    last_updated = datetime.now(ZoneInfo(TZ)).strftime("%Y-%m-%d %H:%M %Z")
-    
-    sections_html = "\n".join(
-        f"""
-        <section id="{sec['id']}">
-          <h2>{sec['title']}</h2>
-          <p class="blurb">{sec['blurb']}</p>
-          {sec['fig_html']}
+# Static templates (plain strings, filled with format_map; CSS braces are doubled)
+_SECTION_TEMPLATE = """
+        <section id="{id}">
+          <h2>{title}</h2>
+          <p class="blurb">{blurb}</p>
+          {fig_html}
         </section>
-        """ for sec in fig_sections
-    )
+        """
 
-    return f"""<!doctype html>
+_PAGE_TEMPLATE = """<!doctype html>
 <html lang="en">
 <head>
   <meta charset="utf-8">
-  <title>{SITE_TITLE}</title>
+  <title>{site_title}</title>
   <meta name="viewport" content="width=device-width, initial-scale=1">
-  <meta name="description" content="{SITE_TAGLINE}">
+  <meta name="description" content="{tagline}">
   <style>
   
   /* peak table styling */
@@ -88,8 +74,8 @@ table.peak-table {{
 <body>
   <header>
     <div class="wrap">
-      <h1>{SITE_TITLE}</h1>
-      <p class="tagline">{SITE_TAGLINE}</p>
+      <h1>{site_title}</h1>
+      <p class="tagline">{tagline}</p>
       <nav>
         <a href="#actual-load">Actual Load</a>
         <a href="#notes">Notes</a>
@@ -103,7 +89,7 @@ table.peak-table {{
       <section id="notes">
         <h2>Notes</h2>
         <ul>
-          <li>Times are displayed in TZ: {TZ}.</li>
+          <li>Times are displayed in TZ: {tz}.</li>
           <li>A load for a specific hour indicates the average load during a one hour period. As an example, a data point at 15:00 indicates the average load between 15:00-16:00.</li>
           <li>Data source: ENTSO-E.</li>
         </ul>
@@ -117,3 +103,68 @@ table.peak-table {{
   </footer>
 </body>
 </html>"""
+
+# Split around the sections so the page can be emitted piece by piece
+_PAGE_HEAD, _PAGE_TAIL = _PAGE_TEMPLATE.split("{sections_html}")
+
+
+def iter_page_parts(fig_sections):
+  
+    """
+    fig_sections: list of dicts with keys:
+      - id: str, section id for linking
+      - title: str, section title
+      - blurb: str, short description
+      - fig_html: str, plotly figure HTML div
+      
+    Yields: the page in pieces (head, each section, tail), so it can be streamed to disk.
+    
+    """
+  
+    fields = {
+        "site_title": SITE_TITLE,
+        "tagline": SITE_TAGLINE,
+        "tz": TZ,
+        "last_updated": datetime.now(ZoneInfo(TZ)).strftime("%Y-%m-%d %H:%M %Z"),
+    }
+    
+    yield _PAGE_HEAD.format_map(fields)
+    
+    for i, sec in enumerate(fig_sections):
+        if i:
+            yield "\n"
+        yield _SECTION_TEMPLATE.format_map(sec)
+    
+    yield _PAGE_TAIL.format_map(fields)
+
+#########################################################################################
+
+def build_page(fig_sections):
+  
+    """
+    Same as iter_page_parts, but returns the full HTML page as a str.
+    
+    """
+    
+    return "".join(iter_page_parts(fig_sections))
+
+#########################################################################################
+
+def write_precompressed(path: Path) -> None:
+    """
+    Write gzip (.gz) and, when the optional `brotli` package is installed, brotli (.br) siblings of a
+    generated file, for servers that serve them directly.
+    
+    path: file to compress, e.g. docs/index.html.
+    
+    NOTE: mtime=0 keeps the gzip bytes stable for an unchanged page.
+    """
+    data = path.read_bytes()
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(data, compresslevel=9, mtime=0))
+    
+    try:
+        import brotli
+    except ImportError:
+        print(f" Skipped {path.name}.br: install the optional `brotli` package to also write it")
+        return
+    path.with_name(path.name + ".br").write_bytes(brotli.compress(data, quality=11))
@@ -1,45 +1,238 @@
+import functools
+import hashlib
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
+import plotly
+import plotly.graph_objects as go
+import tsdownsample
+from tsdownsample import LTTBDownsampler
 
 from config import (
     TZ, COUNTRY_CODE, DAYS_BACK, BACKFILL_DAYS, INITIAL_HISTORY_DAYS,
     SITE_TITLE, SITE_TAGLINE, OUTPUT_DIR, OUTPUT_FILE, PARQUET_FILE, 
-    DATA_DIR, ZONE_CODES, TARGET_ZONES, INITIAL_DAYS
+    DATA_DIR, ZONE_CODES, TARGET_ZONES, INITIAL_DAYS, PLOT_MAX_POINTS
 )
 
 
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    
+    """
+    Largest-Triangle-Three-Buckets downsampling (tsdownsample's compiled implementation).
+    
+    x: monotonic numeric array (e.g. datetimes as int64).
+    y: values, same length as x.
+    n_out: number of points to keep.
+    
+    Returns: sorted indices of the kept points (first and last are always kept).
+    
+    """
+    
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    return LTTBDownsampler().downsample(np.asarray(x), np.asarray(y), n_out=n_out).astype(np.int64)
+
+#########################################################################################
+
+def downsample_before(df: pd.DataFrame, cutoff: pd.Timestamp, n_out: int = PLOT_MAX_POINTS) -> pd.DataFrame:
+    
+    """
+    LTTB-downsample the rows of one series that lie before `cutoff`; rows from `cutoff` on are kept as is.
+    
+    df: columns ["Date","Load (MW)", ...] sorted by Date.
+    cutoff: tz-aware timestamp, e.g. the start of the initial viewport.
+    n_out: points to keep from the older part.
+    
+    Returns: DataFrame with the same columns, still sorted by Date.
+    
+    """
+    
+    older = (df["Date"] < cutoff).to_numpy()
+    if older.sum() <= n_out:
+        return df
+
+    old = df[older]
+    keep = lttb(old["Date"].values.astype("int64"), old["Load (MW)"].values, n_out)
+    
+    return pd.concat([old.iloc[keep], df[~older]])
+
+#########################################################################################
+
+def take_dates_before(df: pd.DataFrame, cutoff: pd.Timestamp, dates: pd.Series) -> pd.DataFrame:
+    
+    """
+    Keep only the given timestamps among the rows before `cutoff`; rows from `cutoff` on are kept as is.
+    
+    df: columns ["Date","Load (MW)", ...] sorted by Date.
+    cutoff: tz-aware timestamp, e.g. the start of the initial viewport.
+    dates: timestamps to keep from the older part (e.g. another series' downsample_before result).
+    
+    Returns: DataFrame with the same columns, still sorted by Date.
+    
+    """
+    
+    older = df["Date"] < cutoff
+    
+    return df[~older | df["Date"].isin(dates)]
+
+#########################################################################################
+
+def to_plot_arrays(df: pd.DataFrame) -> tuple[pd.Series, np.ndarray]:
+    
+    """
+    Date/load columns in the form that keeps the serialized figure smallest over the wire.
+    
+    df: columns ["Date","Load (MW)"], Date tz-aware (display TZ) or naive.
+    
+    Returns: (x, y) with x = the Date column as is and y as a float32 numpy array.
+    
+    NOTE: y is emitted as a base64 "f4" typed array. x stays as ISO date strings (local wall-clock time):
+    hourly timestamps compress far better under gzip than float64 epoch ms do, and Pages serves gzip.
+    
+    """
+    
+    return df["Date"], df["Load (MW)"].to_numpy(dtype="float32")
+
+#########################################################################################
+
+@functools.lru_cache(maxsize=None)
+def _range_buttons_prefix(n_fit: int) -> tuple[dict, ...]:
+    
+    """Buttons for the first `n_fit` fixed windows plus YTD and All, built once per count."""
+    
+    return tuple(button for _, button in _RANGE_BUTTONS[:n_fit]) + _OPEN_BUTTONS
+
+#########################################################################################
+
+def range_buttons(span: pd.Timedelta) -> list[dict]:
+    
+    """
+    Rangeselector buttons for data covering `span`.
+    
+    span: time between the first and the last timestamp of the plotted data.
+    
+    Returns: the fixed-window buttons (1d ... 1y) that fit in span, followed by YTD and All.
+    
+    """
+    
+    # The windows are ascending, so the buttons that fit are a prefix; NaT/NaN spans fit none
+    hours = span / pd.Timedelta(hours=1)
+    n_fit = sum(window <= hours for window, _ in _RANGE_BUTTONS)
+    
+    return list(_range_buttons_prefix(n_fit))
+
+#########################################################################################
+
+def fig_to_html(fig: go.Figure, div_id: str, include_plotlyjs: str | bool = False) -> str:
+    
+    """
+    Export a figure as an HTML snippet for the page.
+    
+    fig: plotly Figure.
+    div_id: id of the figure's <div>; fixed, so an unchanged figure renders to identical HTML.
+    include_plotlyjs: script URL for plotly.js on the first figure of the page, False for the rest
+    (they reuse the already loaded library).
+    
+    Returns: HTML <div> (+ optional <script src>) as a str.
+    
+    """
+    
+    return fig.to_html(include_plotlyjs=include_plotlyjs, full_html=False, div_id=div_id,
+                       config={"displaylogo": False, "responsive": True})
+
+#########################################################################################
+
+def figure_cache_key(df: pd.DataFrame, **params) -> str:
+    
+    """
+    Content hash identifying a rendered figure.
+    
+    df: the figure's input data.
+    params: any other inputs that change the output (tz, viewport, ...).
+    
+    Returns: hex digest over the data, params, this module's source and the plotly/tsdownsample versions,
+    so changes to the plotting code or the libraries it renders/downsamples with also invalidate cached figures.
+    
+    """
+    
+    h = hashlib.blake2b(digest_size=16)
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    h.update(repr(sorted(params.items())).encode())
+    h.update(Path(__file__).read_bytes())
+    h.update(plotly.__version__.encode())
+    h.update(tsdownsample.__version__.encode())
+    
+    return h.hexdigest()
+
+#########################################################################################
+
+# Rangeselector buttons with the window they cover (hours); only windows the data actually spans are offered
+_RANGE_BUTTONS = (
+    (24,   dict(count=24, step="hour",  stepmode="backward", label="1d")),
+    (72,   dict(count=3,  step="day",   stepmode="backward", label="3d")),
+    (168,  dict(count=7,  step="day",   stepmode="backward", label="7d")),
+    (720,  dict(count=1,  step="month", stepmode="backward", label="1m")),
+    (2160, dict(count=3,  step="month", stepmode="backward", label="3m")),
+    (8760, dict(count=1,  step="year",  stepmode="backward", label="1y")),
+)
+_OPEN_BUTTONS = (
+    dict(step="year", stepmode="todate", label="YTD"),
+    dict(step="all", label="All"),
+)
+
+# Layout shared by the load plots, built once at import; the title, x range/title and buttons are set per figure
+_LOAD_LAYOUT = dict(
+    template="plotly_white",
+    hovermode="x unified",
+    xaxis=dict(
+        type="date",
+        rangeslider=dict(visible=True, thickness=0.05),   # thin slider = small mini-chart to redraw
+    ),
+    yaxis=dict(title="Load (MW)"),
+    margin=dict(l=60, r=30, t=60, b=40),
+    uirevision="static",                   # keep zoom/pan state on layout updates instead of re-rendering
+)
+
 # The load shown a specific hour is the average load over that hour: 
 # e.g the load shown at 01:00 is the average load from 01:00 to 01:59
 def make_actual_load_plot(df: pd.DataFrame, title: str, initial_days: int = INITIAL_DAYS):
     
-    fig = px.line(df, x="Date", y="Load (MW)", title=title, template="plotly_white")
+    """
+    
+    df: columns ["Date","Load (MW)"] in display TZ, sorted by Date.
+    
+    Returns: plotly Figure object.
+    
+    """
+    
+    assert df["Date"].is_monotonic_increasing, "make_actual_load_plot expects df sorted by Date"
+    
+    # Plot a visually equivalent LTTB subset; the full series stays available as an opt-in trace
+    full_df = df
+    if len(df) > PLOT_MAX_POINTS:
+        df = df.iloc[lttb(df["Date"].values.astype("int64"), df["Load (MW)"].values, PLOT_MAX_POINTS)]
+
+    # WebGL line instead of an SVG path, fed typed arrays
+    x, y = to_plot_arrays(df)
+    fig = go.Figure(go.Scattergl(x=x, y=y, mode="lines", name="Load (MW)"))
 
-    # Compute initial viewport (last `initial_days` days)
-    end  = df["Date"].max()
+    if df is not full_df:
+        x, y = to_plot_arrays(full_df)
+        fig.add_trace(go.Scattergl(
+            x=x, y=y, mode="lines",
+            name="Full resolution", visible="legendonly",
+        ))
+
+    # Compute initial viewport (last `initial_days` days); df is sorted by Date, so the last row is the latest
+    first, end = (full_df["Date"].iat[0], full_df["Date"].iat[-1]) if len(full_df) else (pd.NaT, pd.NaT)
     start = end - pd.Timedelta(days=initial_days)
 
-    fig.update_layout(
-        hovermode="x unified",
-        xaxis=dict(
-            title=f"Date ({TZ})",
-            range=[start, end],                 
-            rangeslider=dict(visible=True),
-            rangeselector=dict(
-                buttons=[
-                    dict(count=24, step="hour", stepmode="backward", label="1d"),
-                    dict(count=3,  step="day",  stepmode="backward", label="3d"),
-                    dict(count=7,  step="day",  stepmode="backward", label="7d"),
-                    dict(count=1,  step="month",stepmode="backward", label="1m"),
-                    dict(count=3,  step="month",stepmode="backward", label="3m"),
-                    dict(count=1,  step="year", stepmode="backward", label="1y"),
-                    dict(step="year", stepmode="todate", label="YTD"),
-                    dict(step="all", label="All"),
-                ]
-            ),
-        ),
-        yaxis=dict(title="Load (MW)"),
-        margin=dict(l=60, r=30, t=60, b=40),
-    )
+    fig.update_layout(**_LOAD_LAYOUT, title=title)
+    fig.update_xaxes(title=f"Date ({TZ})", range=[start, end], rangeslider_yaxis_rangemode="auto",
+                     rangeselector_buttons=range_buttons(end - first))
     
     return fig
 
@@ -47,69 +240,55 @@ def make_actual_load_plot(df: pd.DataFrame, title: str, initial_days: int = INIT
 
 # TODO: Somewhere before plotting, add 1-hour shift to the data so that the hour shown is the hour when the avarage load was measured
 # (e.g. the load shown at 01:00 is the average load from 01:00 to 01:59) CHANGE THIS
-def make_all_zones_plot(df_long: pd.DataFrame, title: str, tz_label: str, initial_days: int = INITIAL_DAYS, order: list[str] = TARGET_ZONES) -> px.line:
+def make_all_zones_plot(df_long: pd.DataFrame, title: str, tz_label: str, initial_days: int = INITIAL_DAYS, order: list[str] = TARGET_ZONES) -> go.Figure:
     
     """
     
     df_long: columns ["Date","Load (MW)","zone"] in display TZ.
-    Includes 'SE_total' and 'SE1'..'SE4' in the same frame.
+    Includes 'SE_total' and 'SE1'..'SE4' in the same frame; zone is an ordered Categorical (see to_display_table).
+    Each zone's rows must be sorted by Date (to_display_table sorts by zone, then Date).
     
     Returns: plotly Figure object.
     
     """
     
+    # Partition the frame once, then add traces in the requested zone order
     if "zone" in df_long.columns:
-        df_long = df_long.copy()
-        df_long["zone"] = pd.Categorical(df_long["zone"], categories=order, ordered=True)
-        
-    fig = px.line(
-        df_long,
-        x="Date",
-        y="Load (MW)",
-        color="zone",
-        category_orders={"zone": order},
-        title=title,
-        template="plotly_white",
-    )
-
-    # Initial viewport = last N days (data still contains the full range)
-    end = df_long["Date"].max()
+        groups = {zone: g for zone, g in df_long.groupby("zone", sort=False, observed=True)}
+        zones = [zl for zl in order if zl in groups]
+    else:
+        groups = {"Load (MW)": df_long} if len(df_long) else {}
+        zones = list(groups)
+
+    assert all(g["Date"].is_monotonic_increasing for g in groups.values()), \
+        "make_all_zones_plot expects each zone sorted by Date"
+
+    # Initial viewport = last N days (data still contains the full range);
+    # each zone is sorted by Date, so the latest timestamp is the max over the zones' last rows
+    end = max((g["Date"].iat[-1] for g in groups.values()), default=pd.NaT)
     start = end - pd.Timedelta(days=initial_days)
 
-    fig.update_layout(
-        hovermode="x unified",
-        xaxis=dict(
-            title=f"Date ({tz_label})",
-            range=[start, end],
-            rangeslider=dict(visible=True),
-            rangeselector=dict(
-                buttons=[
-                    dict(count=24, step="hour",  stepmode="backward", label="1d"),
-                    dict(count=3,  step="day",   stepmode="backward", label="3d"),
-                    dict(count=7,  step="day",   stepmode="backward", label="7d"),
-                    dict(count=1,  step="month", stepmode="backward", label="1m"),
-                    dict(count=3,  step="month", stepmode="backward", label="3m"),
-                    dict(count=1,  step="year", stepmode="backward", label="1y"),                    
-                    dict(step="year", stepmode="todate", label="YTD"),
-                    dict(step="all", label="All"),
-                ]
-            ),
-        ),
-        yaxis=dict(title="Load (MW)"),
-        margin=dict(l=60, r=30, t=60, b=40),
-        legend_title_text="Zone",
-    )
-    
-    # Force step-like plotting
-    fig.update_traces(line_shape="hv")
-
-    # Make SE_total a bit more prominent
-    for tr in fig.data:
-        if getattr(tr, "name", "") == "SE_total":
-            tr.update(line=dict(width=3))
-        else:
-            tr.update(line=dict(width=2))
-            
+    # The initial viewport stays at full resolution. Older history is LTTB-downsampled per zone, on a
+    # share of the point budget each, and every zone keeps the union of those timestamps: the traces
+    # line up under the unified hover and each zone's own peaks/troughs survive (at coarser buckets
+    # than one series would get from the whole budget)
+    per_zone = PLOT_MAX_POINTS // max(len(zones), 1)
+    kept_dates = pd.concat([downsample_before(groups[zone], start, per_zone)["Date"] for zone in zones]) \
+        if zones else df_long["Date"]
+
+    # WebGL line per zone, built straight from the columns (no plotly.express frame reshaping)
+    fig = go.Figure()
+    for zone in zones:
+        x, y = to_plot_arrays(take_dates_before(groups[zone], start, kept_dates))
+        fig.add_trace(go.Scattergl(
+            x=x, y=y, mode="lines", name=zone,
+            line=dict(width=3 if zone == "SE_total" else 2),   # make SE_total a bit more prominent
+        ))
+
+    fig.update_layout(**_LOAD_LAYOUT, title=title, legend_title_text="Zone")
+    first = min((g["Date"].iat[0] for g in groups.values()), default=pd.NaT)
+    fig.update_xaxes(title=f"Date ({tz_label})", range=[start, end], rangeselector_buttons=range_buttons(end - first))
+    
     return fig
 
 #########################################################################################
\ No newline at end of file